@@ -5,7 +5,7 @@ import os
 from os import path as op
 
 from ..utils import _get_path, _do_path_update
-from ...utils import _fetch_file, _url_to_local_path, verbose
+from ...utils import _fetch_file, _fetch_files, _url_to_local_path, verbose
 
 
 EEGMI_URL = 'http://www.physionet.org/physiobank/database/eegmmidb/'
@@ -160,10 +160,30 @@ def load_data(subject, runs, path=None, force_update=False, update_path=None,
     if not hasattr(runs, '__iter__'):
         runs = [runs]
 
+    key = 'MNE_DATASETS_EEGBCI_PATH'
+    name = 'EEGBCI'
+    path = _get_path(path, key, name)
+    base_path = op.join(path, 'MNE-eegbci-data')
     data_paths = []
+    urls = []
+    destinations = []
     for r in runs:
         url = '{u}S{s:03d}/S{s:03d}R{r:02d}.edf'.format(u=base_url,
                                                         s=subject, r=r)
-        data_paths.extend(data_path(url, path, force_update, update_path))
+        destination = _url_to_local_path(url, base_path)
+        data_paths.append(destination)
+        if not op.isfile(destination) or force_update:
+            if op.isfile(destination):
+                os.remove(destination)
+            if not op.isdir(op.dirname(destination)):
+                os.makedirs(op.dirname(destination))
+            urls.append(url)
+            destinations.append(destination)
+
+    # Fetch the missing files, downloading them concurrently
+    if len(urls) > 0:
+        _fetch_files(urls, destinations)
 
+    # Offer to update the path
+    _do_path_update(path, update_path, key, name)
     return data_paths
@@ -28,7 +28,8 @@ from mne.utils import (set_log_level, set_log_file, _TempDir,
                        _get_call_line, compute_corr, sys_info, verbose,
                        check_fname, requires_ftp, get_config_path,
                        object_size, buggy_mkl_svd, _get_inst_data,
-                       copy_doc, copy_function_doc_to_method_doc, ProgressBar)
+                       copy_doc, copy_function_doc_to_method_doc, ProgressBar,
+                       _fetch_files, _check_hash_sidecar, _write_hash_sidecar)
 
 
 warnings.simplefilter('always')  # enable b/c these tests throw warnings
@@ -303,7 +304,16 @@ def test_estimate_rank():
                        np.ones(10))
     data[0, 0] = 0
     assert_equal(estimate_rank(data), 9)
+    assert_equal(estimate_rank(data, method='gram'), 9)
+    assert_equal(estimate_rank(data, method='randomized', random_state=0), 9)
+    # the default must resolve singular values the Gram shortcut cannot
+    rng = np.random.RandomState(0)
+    u, _ = np.linalg.qr(rng.randn(100, 100))
+    s = np.logspace(0, -10, 100)
+    cov = np.dot(u * s, u.T)
+    assert_equal(estimate_rank(cov, tol='auto', norm=False), 100)
     assert_raises(ValueError, estimate_rank, data, 'foo')
+    assert_raises(ValueError, estimate_rank, data, method='foo')
 
 
 def test_logging():
@@ -512,6 +522,44 @@ def test_fetch_file_ftp():
     _test_fetch('ftp://speedtest.tele2.net/1KB.zip')
 
 
+def test_fetch_files():
+    """Test argument checks and error propagation of the batch fetcher."""
+    tempdir = _TempDir()
+    assert_raises(ValueError, _fetch_files, ['url_1', 'url_2'],
+                  [op.join(tempdir, 'a')], verbose=False)
+    # a failing worker must propagate its error to the caller
+    assert_raises(Exception, _fetch_files, ['NOT_AN_ADDRESS'],
+                  [op.join(tempdir, 'a')], verbose=False)
+    # the expected hash length depends on hash_type
+    assert_raises(ValueError, _fetch_file, 'NOT_AN_ADDRESS',
+                  op.join(tempdir, 'a'), hash_='a' * 32, hash_type='sha1',
+                  verbose=False)
+
+
+def test_hash_sidecar():
+    """Test the verified-download hash sidecar."""
+    tempdir = _TempDir()
+    fname = op.join(tempdir, 'foo')
+    with open(fname, 'wb') as fid:
+        fid.write(b'abcd')
+    hash_ = md5sum(fname)
+    assert_true(not _check_hash_sidecar(fname, hash_, 'md5'))
+    _write_hash_sidecar(fname, hash_, 'md5')
+    assert_true(_check_hash_sidecar(fname, hash_, 'md5'))
+    assert_true(not _check_hash_sidecar(fname, 'a' * 32, 'md5'))
+    assert_true(not _check_hash_sidecar(fname, hash_, 'sha1'))
+    # mtime change invalidates the sidecar
+    st = os.stat(fname)
+    os.utime(fname, (st.st_atime, st.st_mtime + 1))
+    assert_true(not _check_hash_sidecar(fname, hash_, 'md5'))
+    # ... as does a size change
+    _write_hash_sidecar(fname, hash_, 'md5')
+    assert_true(_check_hash_sidecar(fname, hash_, 'md5'))
+    with open(fname, 'wb') as fid:
+        fid.write(b'abcde')
+    assert_true(not _check_hash_sidecar(fname, hash_, 'md5'))
+
+
 def test_sum_squared():
     """Test optimized sum of squares."""
     X = np.random.RandomState(0).randint(0, 50, (3, 3))
@@ -7,35 +7,35 @@ from __future__ import print_function
 # License: BSD (3-clause)
 
 import atexit
+from contextlib import closing
 from distutils.version import LooseVersion
 from functools import wraps
-import ftplib
 from functools import partial
 import hashlib
 import inspect
 import json
 import logging
-from math import log, ceil
+from math import ceil, sqrt
 import multiprocessing
 import operator
 import os
 import os.path as op
 import platform
+import re
 import shutil
 from shutil import rmtree
 from string import Formatter
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import traceback
 import warnings
 import webbrowser
 
 import numpy as np
-from scipy import linalg, sparse
 
-from .externals.six.moves import urllib
 from .externals.six import string_types, StringIO, BytesIO, integer_types
 from .externals.decorator import decorator
 
@@ -185,6 +185,7 @@ def object_size(x):
     size : int
         The estimated size in bytes of the object.
     """
+    from scipy import sparse
     # Note: this will not process object arrays properly (since those only)
     # hold references
     if isinstance(x, (bytes, string_types, int, float, type(None))):
@@ -228,6 +229,7 @@ def object_diff(a, b, pre=''):
     diffs : str
         A string representation of the differences.
     """
+    from scipy import sparse
     out = ''
     if type(a) != type(b):
         out += pre + ' type mismatch (%s, %s)\n' % (type(a), type(b))
@@ -297,10 +299,17 @@ def check_random_state(seed):
 def split_list(l, n):
     """Split list in n (approx) equal pieces."""
     n = int(n)
-    sz = len(l) // n
-    for i in range(n - 1):
-        yield l[i * sz:(i + 1) * sz]
-    yield l[(n - 1) * sz:]
+    if isinstance(l, np.ndarray):
+        # array_split yields views, avoiding n Python-level copies
+        for part in np.array_split(l, n):
+            yield part
+        return
+    sz, rem = divmod(len(l), n)
+    start = 0
+    for ii in range(n):
+        stop = start + sz + (1 if ii < rem else 0)
+        yield l[start:stop]
+        start = stop
 
 
 def create_chunks(sequence, size):
@@ -445,7 +454,8 @@ class _TempDir(str):
         rmtree(self._path, ignore_errors=True)
 
 
-def estimate_rank(data, tol='auto', return_singular=False, norm=True):
+def estimate_rank(data, tol='auto', return_singular=False, norm=True,
+                  method='exact', random_state=None):
     """Estimate the rank of data.
 
     This function will normalize the rows of the data (typically
@@ -468,6 +478,20 @@ def estimate_rank(data, tol='auto', return_singular=False, norm=True):
     norm : bool
         If True, data will be scaled by their estimated row-wise norm.
         Else data are assumed to be scaled. Defaults to True.
+    method : str
+        Can be 'exact' (default), 'gram', or 'randomized'. 'exact'
+        computes the singular values with a (values-only) SVD. 'gram'
+        thresholds the eigenvalues of the smaller Gram matrix, which is
+        faster but cannot resolve singular values below ``sqrt(eps)``
+        times the largest one, so it should only be used with a ``tol``
+        coarser than that (e.g. the 1e-4 used for rank-deficiency
+        checks). 'randomized' estimates only the leading singular values
+        using a randomized range finder (Halko et al. 2011), growing the
+        number of values until the smallest one falls below ``tol``; it
+        is much faster for large low-rank matrices. Both alternatives
+        are ignored when ``return_singular=True``.
+    random_state : int | None
+        Seed for the randomized method. Ignored for other methods.
 
     Returns
     -------
@@ -477,11 +501,46 @@ def estimate_rank(data, tol='auto', return_singular=False, norm=True):
         If return_singular is True, the singular values that were
         thresholded to determine the rank are also returned.
     """
-    data = data.copy()  # operate on a copy
+    from scipy import linalg
+    if method not in ('exact', 'gram', 'randomized'):
+        raise ValueError("method must be 'exact', 'gram', or 'randomized', "
+                         "got %s" % (method,))
     if norm is True:
-        norms = _compute_row_norms(data)
-        data /= norms[:, np.newaxis]
-    s = linalg.svd(data, compute_uv=False, overwrite_a=True)
+        row_norm = _get_numba_row_norm()
+        if row_norm is not None and data.dtype == np.float64:
+            data = data.copy()  # normalized in place by the fused kernel
+            row_norm(data)
+        else:
+            norms = _compute_row_norms(data)
+            # dividing into a fresh array doubles as our copy of the data
+            data = data / norms[:, np.newaxis]
+    if return_singular is True or method == 'exact':
+        if norm is not True:
+            data = data.copy()  # operate on a copy
+        s = linalg.svd(data, compute_uv=False, overwrite_a=True)
+    elif method == 'randomized':
+        if isinstance(tol, string_types) and tol != 'auto':
+            raise ValueError('tol must be "auto" or float')
+        return _estimate_rank_randomized(data, tol, random_state)
+    else:
+        # Go through the smaller Gram matrix: its eigenvalues are the
+        # squared singular values, costing O(min(m, n) ** 2 * max(m, n))
+        # instead of a full SVD, but limiting the resolvable dynamic
+        # range to sqrt(eps) (see the docstring).
+        if data.shape[0] <= data.shape[1]:
+            gram = np.dot(data, data.T)
+        else:
+            gram = np.dot(data.T, data)
+        eigvals = linalg.eigvalsh(gram)
+        if isinstance(tol, string_types):
+            if tol != 'auto':
+                raise ValueError('tol must be "auto" or float')
+            # the Gram eigenvalues carry a noise floor of roughly
+            # amax(eigvals) * eps, so the auto threshold must be computed
+            # in the eigenvalue domain before taking the square root
+            eps = np.finfo(float).eps
+            tol = np.sqrt(np.max(data.shape) * np.amax(eigvals) * eps)
+        s = np.sqrt(np.maximum(eigvals, 0.))[::-1]
     if isinstance(tol, string_types):
         if tol != 'auto':
             raise ValueError('tol must be "auto" or float')
@@ -497,11 +556,65 @@ def estimate_rank(data, tol='auto', return_singular=False, norm=True):
 
 def _compute_row_norms(data):
     """Compute scaling based on estimated norm."""
-    norms = np.sqrt(np.sum(data ** 2, axis=1))
+    # single-pass einsum avoids the full-size data ** 2 temporary
+    norms = np.sqrt(np.einsum('ij,ij->i', data, data))
     norms[norms == 0] = 1.0
     return norms
 
 
+_numba_row_norm = False  # False means "not yet attempted"
+
+
+def _get_numba_row_norm():
+    """Build (once) a Numba-fused in-place row normalizer, or None."""
+    global _numba_row_norm
+    if _numba_row_norm is False:
+        try:
+            from numba import njit, prange
+        except ImportError:
+            _numba_row_norm = None
+        else:
+            @njit(parallel=True, fastmath=True)
+            def _row_norm(data):  # pragma: no cover (requires numba)
+                # fuses square, reduce, sqrt, and divide into one pass
+                for ii in prange(data.shape[0]):
+                    acc = 0.
+                    for jj in range(data.shape[1]):
+                        acc += data[ii, jj] * data[ii, jj]
+                    inv = 1. / sqrt(acc) if acc > 0 else 1.
+                    for jj in range(data.shape[1]):
+                        data[ii, jj] *= inv
+            _numba_row_norm = _row_norm
+    return _numba_row_norm
+
+
+def _estimate_rank_randomized(data, tol, random_state=None):
+    """Estimate rank from a randomized partial SVD (Halko et al. 2011)."""
+    from scipy import linalg
+    rng = check_random_state(random_state)
+    n_small = min(data.shape)
+    n_oversample = 10
+    k = min(50, n_small)
+    eps = np.finfo(float).eps
+    while True:
+        if k + n_oversample >= n_small:
+            # no savings left over an exact (values-only) SVD
+            s = linalg.svd(data, compute_uv=False)
+        else:
+            # project onto a random subspace capturing the top k directions,
+            # then take the cheap SVD of the small projected matrix
+            omega = rng.standard_normal((data.shape[1], k + n_oversample))
+            q, _ = linalg.qr(np.dot(data, omega), mode='economic')
+            s = linalg.svd(np.dot(q.T, data), compute_uv=False)[:k]
+        if isinstance(tol, string_types):  # 'auto'
+            this_tol = np.max(data.shape) * s[0] * eps
+        else:
+            this_tol = float(tol)
+        if s[-1] < this_tol or len(s) == n_small:
+            return int(np.sum(s > this_tol))
+        k = min(2 * k, n_small)
+
+
 def _reject_data_segments(data, reject, flat, decim, info, tstep):
     """Reject data segments using peak-to-peak amplitude."""
     from .epochs import _is_good
@@ -707,12 +820,21 @@ def verbose(function, *args, **kwargs):
     set_log_level
     set_config
     """  # noqa: E501
-    arg_names = _get_args(function)
+    # the signature inspection is invariant per function, so only do it on
+    # the first call and stash the result on the function itself
+    try:
+        is_method, verbose_idx = function._verbose_spec
+    except AttributeError:
+        arg_names = _get_args(function)
+        is_method = len(arg_names) > 0 and arg_names[0] == 'self'
+        verbose_idx = (arg_names.index('verbose')
+                       if 'verbose' in arg_names else -1)
+        function._verbose_spec = (is_method, verbose_idx)
     default_level = verbose_level = None
-    if len(arg_names) > 0 and arg_names[0] == 'self':
+    if is_method:
         default_level = getattr(args[0], 'verbose', None)
-    if 'verbose' in arg_names:
-        verbose_level = args[arg_names.index('verbose')]
+    if verbose_idx != -1:
+        verbose_level = args[verbose_idx]
     elif 'verbose' in kwargs:
         verbose_level = kwargs.pop('verbose')
 
@@ -720,6 +842,16 @@ def verbose(function, *args, **kwargs):
     verbose_level = default_level if verbose_level is None else verbose_level
 
     if verbose_level is not None:
+        # Skip the set/restore cycle when the requested level is already
+        # active; invalid values fall through to use_log_level so they
+        # still raise the usual error.
+        level = verbose_level
+        if isinstance(level, bool):
+            level = 'INFO' if level else 'WARNING'
+        if isinstance(level, string_types):
+            level = _LOGGING_TYPES.get(level.upper())
+        if level is not None and level == logger.level:
+            return function(*args, **kwargs)
         # set it back if we get an exception
         with use_log_level(verbose_level):
             return function(*args, **kwargs)
@@ -1171,6 +1303,54 @@ def _import_mlab():
     return mlab
 
 
+_PATH_TILDE_CACHE = dict()  # avoid re-scanning PATH on every subprocess call
+# a tilde-prefixed PATH entry starts either the string or a pathsep-split part
+_PATH_TILDE_RE = re.compile('(^|' + re.escape(os.pathsep) + ')~')
+
+
+def _communicate_bounded(p, max_buffer):
+    """Drain subprocess pipes via temp files instead of in-memory lists.
+
+    While the command runs, at most ``max_buffer`` bytes per stream are
+    kept in memory and the rest is spilled to a temporary file, avoiding
+    the transient list-of-chunks accumulation of a plain
+    ``communicate()`` call. Note that the full output is still read back
+    and returned at the end, so this bounds memory only while draining.
+    """
+    if os.name != 'posix':  # select() on Windows only handles sockets
+        return p.communicate()
+    try:
+        import selectors
+    except ImportError:  # Python 2: no selectors, accept unbounded buffering
+        return p.communicate()
+    sel = selectors.DefaultSelector()
+    sinks = dict()
+    for fid in (p.stdout, p.stderr):
+        if fid is not None:
+            sel.register(fid, selectors.EVENT_READ)
+            sinks[fid] = tempfile.SpooledTemporaryFile(max_size=max_buffer)
+    while sel.get_map():
+        for key, _ in sel.select():
+            data = os.read(key.fd, 65536)
+            if not data:
+                sel.unregister(key.fileobj)
+            else:
+                sinks[key.fileobj].write(data)
+    sel.close()
+    p.wait()
+    out = list()
+    for fid in (p.stdout, p.stderr):
+        if fid is None:
+            out.append(None)
+        else:
+            sink = sinks[fid]
+            sink.seek(0)
+            out.append(sink.read())
+            sink.close()
+            fid.close()
+    return tuple(out)
+
+
 @verbose
 def run_subprocess(command, verbose=None, *args, **kwargs):
     """Run command using subprocess.Popen.
@@ -1184,6 +1364,13 @@ def run_subprocess(command, verbose=None, *args, **kwargs):
     ----------
     command : list of str | str
         Command to run as subprocess (see subprocess.Popen documentation).
+    max_buffer : int | None
+        If not None, maximum number of bytes of subprocess output (per
+        stream) to keep in memory while the command runs; anything
+        beyond that is spilled to a temporary file (POSIX only). The
+        complete output is still returned, so this only bounds memory
+        during draining. If None (default), output is buffered in
+        memory without limit.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see :func:`mne.verbose`
         and :ref:`Logging documentation <tut_logging>` for more). Defaults to
@@ -1198,6 +1385,7 @@ def run_subprocess(command, verbose=None, *args, **kwargs):
     stderr : str
         Stderr returned by the process.
     """
+    max_buffer = kwargs.pop('max_buffer', None)
     for stdxxx, sys_stdxxx in (['stderr', sys.stderr],
                                ['stdout', sys.stdout]):
         if stdxxx not in kwargs:
@@ -1208,15 +1396,28 @@ def run_subprocess(command, verbose=None, *args, **kwargs):
                 kwargs[stdxxx] = subprocess.PIPE
             else:
                 kwargs[stdxxx] = sys_stdxxx
-
-    # Check the PATH environment variable. If run_subprocess() is to be called
-    # frequently this should be refactored so as to only check the path once.
+    # On Python 2, Popen defaults to bufsize=0 (unbuffered), which means one
+    # syscall per read from the pipes; use the system default buffering
+    # instead unless the caller explicitly asked for something else.
+    kwargs.setdefault('bufsize', -1)
+
+    # Check the PATH environment variable. The check is cached keyed on the
+    # PATH string so that frequent run_subprocess() callers only pay for the
+    # scan (and possibly the warning) once per distinct PATH.
     env = kwargs.get('env', os.environ)
-    if any(p.startswith('~') for p in env['PATH'].split(os.pathsep)):
-        warn('Your PATH environment variable contains at least one path '
-             'starting with a tilde ("~") character. Such paths are not '
-             'interpreted correctly from within Python. It is recommended '
-             'that you use "$HOME" instead of "~".')
+    path = env.get('PATH', '')
+    has_tilde = _PATH_TILDE_CACHE.get(path)
+    if has_tilde is None:
+        # the cheap C-level scan almost always rules a tilde out, so the
+        # regex (and the split it replaces) only runs on rare positives
+        has_tilde = ('~' in path and
+                     _PATH_TILDE_RE.search(path) is not None)
+        _PATH_TILDE_CACHE[path] = has_tilde
+        if has_tilde:
+            warn('Your PATH environment variable contains at least one path '
+                 'starting with a tilde ("~") character. Such paths are not '
+                 'interpreted correctly from within Python. It is recommended '
+                 'that you use "$HOME" instead of "~".')
     if isinstance(command, string_types):
         command_str = command
     else:
@@ -1231,7 +1432,11 @@ def run_subprocess(command, verbose=None, *args, **kwargs):
             command_name = command[0]
         logger.error('Command not found: %s' % command_name)
         raise
-    stdout_, stderr = p.communicate()
+    if max_buffer is not None and (p.stdout is not None or
+                                   p.stderr is not None):
+        stdout_, stderr = _communicate_bounded(p, max_buffer)
+    else:
+        stdout_, stderr = p.communicate()
     stdout_ = '' if stdout_ is None else stdout_.decode('utf-8')
     stderr = '' if stderr is None else stderr.decode('utf-8')
 
@@ -1255,6 +1460,11 @@ def run_subprocess(command, verbose=None, *args, **kwargs):
 ###############################################################################
 # LOGGING
 
+_LOGGING_TYPES = dict(DEBUG=logging.DEBUG, INFO=logging.INFO,
+                      WARNING=logging.WARNING, ERROR=logging.ERROR,
+                      CRITICAL=logging.CRITICAL)
+
+
 def set_log_level(verbose=None, return_old_level=False):
     """Set the logging level.
 
@@ -1278,14 +1488,10 @@ def set_log_level(verbose=None, return_old_level=False):
         else:
             verbose = 'WARNING'
     if isinstance(verbose, string_types):
-        verbose = verbose.upper()
-        logging_types = dict(DEBUG=logging.DEBUG, INFO=logging.INFO,
-                             WARNING=logging.WARNING, ERROR=logging.ERROR,
-                             CRITICAL=logging.CRITICAL)
-        if verbose not in logging_types:
+        try:
+            verbose = _LOGGING_TYPES[verbose.upper()]
+        except KeyError:
             raise ValueError('verbose must be of a valid type')
-        verbose = logging_types[verbose]
-    logger = logging.getLogger('mne')
     old_verbose = logger.level
     logger.setLevel(verbose)
     return (old_verbose if return_old_level else None)
@@ -1533,11 +1739,27 @@ known_config_wildcards = (
 )
 
 
+# Cache of parsed config files, keyed by path and guarded by mtime/size so
+# that out-of-band edits are picked up. Values are copied on the way in and
+# out since callers mutate the returned dict.
+_CONFIG_CACHE = dict()
+
+
 def _load_config(config_path, raise_error=False):
     """Safely load a config file."""
+    try:
+        st = os.stat(config_path)
+        stamp = (st.st_mtime, st.st_size)
+    except OSError:
+        stamp = None
+    cached = _CONFIG_CACHE.get(config_path)
+    if cached is not None and stamp is not None and cached[0] == stamp:
+        return dict(cached[1])
     with open(config_path, 'r') as fid:
         try:
             config = json.load(fid)
+            if stamp is not None:
+                _CONFIG_CACHE[config_path] = (stamp, dict(config))
         except ValueError:
             # No JSON object could be decoded --> corrupt file?
             msg = ('The MNE-Python config file (%s) is not a valid JSON '
@@ -1586,10 +1808,10 @@ def get_config(key=None, default=None, raise_error=False, home_dir=None):
 
     # second, look for it in mne-python config file
     config_path = get_config_path(home_dir=home_dir)
-    if not op.isfile(config_path):
-        config = {}
-    else:
+    try:
         config = _load_config(config_path)
+    except IOError:  # no config file, which is fine
+        config = {}
 
     if key is None:
         # update config with environment variables
@@ -1648,9 +1870,9 @@ def set_config(key, value, home_dir=None, set_env=True):
 
     # Read all previous values
     config_path = get_config_path(home_dir=home_dir)
-    if op.isfile(config_path):
+    try:
         config = _load_config(config_path, raise_error=True)
-    else:
+    except IOError:
         config = dict()
         logger.info('Attempting to create new mne-python configuration '
                     'file:\n%s' % config_path)
@@ -1670,6 +1892,15 @@ def set_config(key, value, home_dir=None, set_env=True):
         os.mkdir(directory)
     with open(config_path, 'w') as fid:
         json.dump(config, fid, sort_keys=True, indent=0)
+    # we know what the file now contains, so refresh the parse cache
+    # directly instead of forcing the next get_config to re-read it
+    try:
+        st = os.stat(config_path)
+    except OSError:
+        _CONFIG_CACHE.pop(config_path, None)
+    else:
+        _CONFIG_CACHE[config_path] = ((st.st_mtime, st.st_size),
+                                      dict(config))
 
 
 class ProgressBar(object):
@@ -1732,6 +1963,16 @@ class ProgressBar(object):
         self.spinner_index = 0
         self.n_spinner = len(self.spinner_symbols)
         self._do_print = verbose_bool
+        self._last_time = 0.
+        # when driven by increments, repaint roughly once per percent of
+        # progress rather than on every call
+        self._update_step = max(int(self.max_value) // 100, 1)
+        self._next_update = self.cur_value + self._update_step
+        # prebuild the bar characters (sliced in update) and bind the
+        # template formatter once rather than per update
+        self._filled = self.progress_character * self.max_chars
+        self._blank = ' ' * self.max_chars
+        self._format = self.template.format
 
     def update(self, cur_value, mesg=None):
         """Update progressbar with current value of process.
@@ -1751,6 +1992,16 @@ class ProgressBar(object):
         # for the progressbar.
         self.cur_value = cur_value
         progress = min(float(self.cur_value) / self.max_value, 1.)
+
+        # Throttle the actual terminal updates (string formatting plus a
+        # write and flush) to ~30 Hz; high-frequency callers like the
+        # download chunk loops would otherwise spend more time painting the
+        # bar than doing work. The final (100%) update always goes through.
+        now = time.time()
+        if progress < 1. and now - self._last_time < 0.033:
+            return
+        self._last_time = now
+
         num_chars = int(progress * self.max_chars)
         num_left = self.max_chars - num_chars
 
@@ -1764,11 +2015,11 @@ class ProgressBar(object):
         # The \r tells the cursor to return to the beginning of the line rather
         # than starting a new line.  This allows us to have a progressbar-style
         # display in the console window.
-        bar = self.template.format(self.progress_character * num_chars,
-                                   ' ' * num_left,
-                                   progress * 100,
-                                   self.spinner_symbols[self.spinner_index],
-                                   self.mesg)
+        bar = self._format(self._filled[:num_chars],
+                           self._blank[:num_left],
+                           progress * 100,
+                           self.spinner_symbols[self.spinner_index],
+                           self.mesg)
         # Force a flush because sometimes when using bash scripts and pipes,
         # the output is not printed until after the program exits.
         if self._do_print:
@@ -1791,9 +2042,18 @@ class ProgressBar(object):
             Message to display to the right of the progressbar.  If None, the
             last message provided will be used.  To clear the current message,
             pass a null string, ''.
+
+        Notes
+        -----
+        The terminal is only repainted about once per percent of
+        progress, so per-chunk callers stay cheap; the final update
+        always goes through.
         """
         self.cur_value += increment_value
-        self.update(self.cur_value, mesg)
+        if self.cur_value >= self._next_update or \
+                self.cur_value >= self.max_value:
+            self._next_update = self.cur_value + self._update_step
+            self.update(self.cur_value, mesg)
 
     def __iter__(self):
         """Iterate to auto-increment the pbar with 1."""
@@ -1804,8 +2064,11 @@ class ProgressBar(object):
             self.update_with_increment_value(1)
 
 
-def _get_ftp(url, temp_file_name, initial_size, file_size, verbose_bool):
+def _get_ftp(url, temp_file_name, initial_size, file_size, verbose_bool,
+             hash_obj=None, accept_ranges=True):
     """Safely (resume a) download to a file from FTP."""
+    import ftplib
+    from .externals.six.moves import urllib
     # Adapted from: https://pypi.python.org/pypi/fileDownloader.py
     # but with changes
 
@@ -1815,35 +2078,133 @@ def _get_ftp(url, temp_file_name, initial_size, file_size, verbose_bool):
     unquoted_server_path = urllib.parse.unquote(server_path)
 
     data = ftplib.FTP()
-    if parsed_url.port is not None:
-        data.connect(parsed_url.hostname, parsed_url.port)
-    else:
-        data.connect(parsed_url.hostname)
-    data.login()
-    if len(server_path) > 1:
-        data.cwd(unquoted_server_path)
-    data.sendcmd("TYPE I")
-    data.sendcmd("REST " + str(initial_size))
-    down_cmd = "RETR " + file_name
-    assert file_size == data.size(file_name)
-    progress = ProgressBar(file_size, initial_value=initial_size,
-                           max_chars=40, spinner=True, mesg='file_sizes',
-                           verbose_bool=verbose_bool)
-
-    # Callback lambda function that will be passed the downloaded data
-    # chunk and will write it to file and update the progress bar
-    mode = 'ab' if initial_size > 0 else 'wb'
-    with open(temp_file_name, mode) as local_file:
-        def chunk_write(chunk):
-            return _chunk_write(chunk, local_file, progress)
-        data.retrbinary(down_cmd, chunk_write)
+    try:
+        if parsed_url.port is not None:
+            data.connect(parsed_url.hostname, parsed_url.port)
+        else:
+            data.connect(parsed_url.hostname)
+        data.login()
+        if len(server_path) > 1:
+            data.cwd(unquoted_server_path)
+        data.sendcmd("TYPE I")
+        data.sendcmd("REST " + str(initial_size))
+        down_cmd = "RETR " + file_name
+        assert file_size == data.size(file_name)
+        progress = ProgressBar(file_size, initial_value=initial_size,
+                               max_chars=40, spinner=True, mesg='file_sizes',
+                               verbose_bool=verbose_bool)
+
+        # Callback lambda function that will be passed the downloaded data
+        # chunk and will write it to file and update the progress bar
+        mode = 'ab' if initial_size > 0 else 'wb'
+        with open(temp_file_name, mode,
+                  buffering=_DOWNLOAD_BLOCK_SIZE) as local_file:
+            def chunk_write(chunk):
+                return _chunk_write(chunk, local_file, progress, hash_obj)
+            data.retrbinary(down_cmd, chunk_write)
+            local_file.flush()
+            os.fsync(local_file.fileno())
+    finally:
         data.close()
     sys.stdout.write('\n')
     sys.stdout.flush()
+    return hash_obj
+
+
+# Download sizing: read/write in ~1 MB blocks to amortize syscall and
+# Python overhead, never shrinking below 8 kB nor growing past 4 MB
+_DOWNLOAD_BLOCK_SIZE = 1048576  # 2 ** 20
+_MIN_DOWNLOAD_BLOCK_SIZE = 8192  # 2 ** 13
+_MAX_DOWNLOAD_BLOCK_SIZE = 4194304  # 2 ** 22
+_N_DOWNLOAD_SEGMENTS = 4
+_MIN_SEGMENT_SIZE = 16777216  # don't bother splitting smaller files
+
+
+def _get_http_segmented(url, temp_file_name, file_size, verbose_bool,
+                        hash_obj, n_segments):
+    """Download a file over parallel HTTP Range requests."""
+    from .externals.six.moves import urllib
+    # A single TCP connection is often limited well below the available
+    # link bandwidth, so fetch n_segments byte ranges concurrently into a
+    # preallocated file.
+    seg = file_size // n_segments
+    starts = [ii * seg for ii in range(n_segments)]
+    stops = starts[1:] + [file_size]
+    progress = ProgressBar(file_size, initial_value=0, max_chars=40,
+                           spinner=True, mesg='file_sizes',
+                           verbose_bool=verbose_bool)
+    with open(temp_file_name, 'wb') as fid:
+        fid.truncate(file_size)
+    lock = threading.Lock()
+    errors = list()
 
-
-def _get_http(url, temp_file_name, initial_size, file_size, verbose_bool):
+    def _fetch_segment(start, stop):
+        try:
+            req = urllib.request.Request(url)
+            req.headers['Range'] = 'bytes=%d-%d' % (start, stop - 1)
+            with closing(urllib.request.urlopen(req)) as response:
+                if response.getcode() != 206:  # partial content
+                    raise RuntimeError('Server does not support the Range '
+                                       'header')
+                with open(temp_file_name, 'rb+',
+                          buffering=_DOWNLOAD_BLOCK_SIZE) as fid:
+                    fid.seek(start)
+                    n_left = stop - start
+                    while n_left > 0:
+                        chunk = response.read(
+                            min(_DOWNLOAD_BLOCK_SIZE, n_left))
+                        if len(chunk) == 0:
+                            raise RuntimeError('Connection closed with %d '
+                                               'bytes remaining' % n_left)
+                        fid.write(chunk)
+                        n_left -= len(chunk)
+                        with lock:
+                            progress.update_with_increment_value(
+                                len(chunk), mesg='file_sizes')
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=_fetch_segment, args=(start, stop))
+               for start, stop in zip(starts, stops)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if len(errors) > 0:
+        raise errors[0]
+    with open(temp_file_name, 'rb+') as fid:
+        os.fsync(fid.fileno())
+    if hash_obj is not None:
+        # segments complete out of order, so hash once at the end
+        with open(temp_file_name, 'rb') as fid:
+            while True:
+                chunk = fid.read(_DOWNLOAD_BLOCK_SIZE)
+                if len(chunk) == 0:
+                    break
+                hash_obj.update(chunk)
+    if verbose_bool:
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+    return hash_obj
+
+
+def _get_http(url, temp_file_name, initial_size, file_size, verbose_bool,
+              hash_obj=None, accept_ranges=True):
     """Safely (resume a) download to a file from http(s)."""
+    from .externals.six.moves import urllib
+    if (initial_size == 0 and accept_ranges and _N_DOWNLOAD_SEGMENTS > 1 and
+            file_size >= _N_DOWNLOAD_SEGMENTS * _MIN_SEGMENT_SIZE):
+        # bigger files leave more single-connection bandwidth on the table,
+        # so split them further
+        n_segments = _N_DOWNLOAD_SEGMENTS
+        if file_size >= 4 * n_segments * _MIN_SEGMENT_SIZE:
+            n_segments *= 2
+        try:
+            return _get_http_segmented(url, temp_file_name, file_size,
+                                       verbose_bool, hash_obj, n_segments)
+        except Exception:
+            logger.info('Segmented download failed, falling back to a '
+                        'single connection.')
     # Actually do the reading
     req = urllib.request.Request(url)
     if initial_size > 0:
@@ -1859,48 +2220,123 @@ def _get_http(url, temp_file_name, initial_size, file_size, verbose_bool):
                     'restart downloading the entire file.')
         del req.headers['Range']
         response = urllib.request.urlopen(req)
-    total_size = int(response.headers.get('Content-Length', '1').strip())
-    if initial_size > 0 and file_size == total_size:
-        logger.info('Resuming download failed (resume file size '
-                    'mismatch). Attempting to restart downloading the '
-                    'entire file.')
+        if initial_size > 0 and hash_obj is not None:
+            # restart invalidates any pre-fed bytes
+            hash_obj = hashlib.new(hash_obj.name)
         initial_size = 0
-    total_size += initial_size
-    if total_size != file_size:
-        raise RuntimeError('URL could not be parsed properly')
-    mode = 'ab' if initial_size > 0 else 'wb'
-    progress = ProgressBar(total_size, initial_value=initial_size,
-                           max_chars=40, spinner=True, mesg='file_sizes',
-                           verbose_bool=verbose_bool)
-    chunk_size = 8192  # 2 ** 13
-    with open(temp_file_name, mode) as local_file:
-        while True:
-            t0 = time.time()
-            chunk = response.read(chunk_size)
-            dt = time.time() - t0
-            if dt < 0.005:
-                chunk_size *= 2
-            elif dt > 0.1 and chunk_size > 8192:
-                chunk_size = chunk_size // 2
-            if not chunk:
-                if verbose_bool:
-                    sys.stdout.write('\n')
-                    sys.stdout.flush()
-                break
-            local_file.write(chunk)
-            progress.update_with_increment_value(len(chunk),
-                                                 mesg='file_sizes')
-
-
-def _chunk_write(chunk, local_file, progress):
+    with closing(response):
+        total_size = int(response.headers.get('Content-Length', '1').strip())
+        if initial_size > 0 and file_size == total_size:
+            logger.info('Resuming download failed (resume file size '
+                        'mismatch). Attempting to restart downloading the '
+                        'entire file.')
+            if hash_obj is not None:
+                # restart invalidates any pre-fed bytes
+                hash_obj = hashlib.new(hash_obj.name)
+            initial_size = 0
+        total_size += initial_size
+        if total_size != file_size:
+            raise RuntimeError('URL could not be parsed properly')
+        mode = 'ab' if initial_size > 0 else 'wb'
+        progress = ProgressBar(total_size, initial_value=initial_size,
+                               max_chars=40, spinner=True, mesg='file_sizes',
+                               verbose_bool=verbose_bool)
+        # start with large chunks to keep the syscall and Python overhead per
+        # byte low; the timing loop below adapts this to the connection speed
+        chunk_size = _DOWNLOAD_BLOCK_SIZE
+        with open(temp_file_name, mode,
+                  buffering=_DOWNLOAD_BLOCK_SIZE) as local_file:
+            preallocated = False
+            if mode == 'wb' and file_size > 0 and \
+                    hasattr(os, 'posix_fallocate'):
+                # let the filesystem lay the file out as one contiguous
+                # extent instead of growing it block by block
+                try:
+                    os.posix_fallocate(local_file.fileno(), 0, file_size)
+                    preallocated = True
+                except OSError:  # e.g. not supported by the filesystem
+                    pass
+            written = initial_size
+            # bind the attribute lookups once; every name in the loop
+            # body below is then a local
+            read = response.read
+            write = local_file.write
+            update = None if hash_obj is None else hash_obj.update
+            clock = time.time
+            try:
+                while True:
+                    t0 = clock()
+                    chunk = read(chunk_size)
+                    dt = clock() - t0
+                    if dt < 0.005 and chunk_size < _MAX_DOWNLOAD_BLOCK_SIZE:
+                        chunk_size *= 2
+                    elif dt > 0.1 and chunk_size > _MIN_DOWNLOAD_BLOCK_SIZE:
+                        chunk_size = chunk_size // 2
+                    if not chunk:
+                        if verbose_bool:
+                            sys.stdout.write('\n')
+                            sys.stdout.flush()
+                        break
+                    write(chunk)
+                    written += len(chunk)
+                    if update is not None:
+                        update(chunk)
+                    # the progress bar throttles its own repaints, so
+                    # reporting every chunk is cheap
+                    progress.update_with_increment_value(len(chunk),
+                                                         mesg='file_sizes')
+            except Exception:
+                if preallocated:
+                    # drop the preallocated-but-unwritten tail so a later
+                    # resume sees the true download size
+                    try:
+                        local_file.truncate(written)
+                    except (IOError, OSError):
+                        pass
+                raise
+            # make sure the bytes are on disk before the verified file
+            # gets its final name
+            local_file.flush()
+            os.fsync(local_file.fileno())
+    return hash_obj
+
+
+def _chunk_write(chunk, local_file, progress, hash_obj=None):
     """Write a chunk to file and update the progress bar."""
     local_file.write(chunk)
+    if hash_obj is not None:
+        hash_obj.update(chunk)
     progress.update_with_increment_value(len(chunk))
 
 
+def _check_hash_sidecar(file_name, hash_, hash_type):
+    """Check the sidecar from a previous verified download of a file."""
+    try:
+        st = os.stat(file_name)
+        with open(file_name + '.mne_sum') as fid:
+            rec = json.load(fid)
+        return (rec.get('size') == st.st_size and
+                rec.get('mtime') == st.st_mtime and
+                rec.get('hash_type') == hash_type and
+                rec.get('hash') == hash_)
+    except (IOError, OSError, ValueError):
+        return False
+
+
+def _write_hash_sidecar(file_name, hash_, hash_type):
+    """Record a verified download so later fetches can skip it."""
+    try:
+        st = os.stat(file_name)
+        with open(file_name + '.mne_sum', 'w') as fid:
+            json.dump(dict(size=st.st_size, mtime=st.st_mtime,
+                           hash_type=hash_type, hash=hash_), fid)
+    except (IOError, OSError):
+        pass  # the sidecar is only an optimization
+
+
 @verbose
 def _fetch_file(url, file_name, print_destination=True, resume=True,
-                hash_=None, timeout=10., verbose=None):
+                hash_=None, hash_type='md5', timeout=10., verbose=None):
     """Load requested file, downloading it if needed or requested.
 
     Parameters
@@ -1917,6 +2353,9 @@ def _fetch_file(url, file_name, print_destination=True, resume=True,
     hash_ : str | None
         The hash of the file to check. If None, no checking is
         performed.
+    hash_type : str
+        The type of hashing to use such as "md5" or "sha1". Must name an
+        algorithm known to :mod:`hashlib`. Defaults to "md5".
     timeout : float
         The URL open timeout.
     verbose : bool, str, int, or None
@@ -1925,37 +2364,45 @@ def _fetch_file(url, file_name, print_destination=True, resume=True,
     """
     # Adapted from NISL:
     # https://github.com/nisl/tutorial/blob/master/nisl/datasets.py
-    if hash_ is not None and (not isinstance(hash_, string_types) or
-                              len(hash_) != 32):
-        raise ValueError('Bad hash value given, should be a 32-character '
-                         'string:\n%s' % (hash_,))
+    from .externals.six.moves import urllib
+    if hash_ is not None:
+        n_chars = 2 * hashlib.new(hash_type).digest_size
+        if not isinstance(hash_, string_types) or len(hash_) != n_chars:
+            raise ValueError('Bad hash value given, should be a %d-character '
+                             'string:\n%s' % (n_chars, hash_))
+        # if a previous download of this file verified and the size and
+        # mtime are unchanged, skip fetching (and re-hashing) it
+        if _check_hash_sidecar(file_name, hash_, hash_type):
+            logger.info('Local copy of %s already verified, skipping '
+                        'download.' % file_name)
+            return
     temp_file_name = file_name + ".part"
     verbose_bool = (logger.level <= 20)  # 20 is info
     try:
-        # Check file size and displaying it alongside the download url
-        u = urllib.request.urlopen(url, timeout=timeout)
-        u.close()
-        # this is necessary to follow any redirects
-        url = u.geturl()
+        # Check file size and displaying it alongside the download url;
+        # a single request suffices since geturl() already reflects any
+        # redirects and the same response carries the headers we need
         u = urllib.request.urlopen(url, timeout=timeout)
         try:
+            url = u.geturl()
             file_size = int(u.headers.get('Content-Length', '1').strip())
+            # servers can explicitly opt out of range requests, which
+            # rules out both resuming and segmented downloads
+            accept_ranges = \
+                u.headers.get('Accept-Ranges', '').lower() != 'none'
         finally:
             u.close()
             del u
         logger.info('Downloading data from %s (%s)\n'
                     % (url, sizeof_fmt(file_size)))
 
-        # Triage resume
-        if not os.path.exists(temp_file_name):
-            resume = False
+        # Triage resume (a single stat covers existence and size)
+        initial_size = 0
         if resume:
-            with open(temp_file_name, 'rb', buffering=0) as local_file:
-                local_file.seek(0, 2)
-                initial_size = local_file.tell()
-            del local_file
-        else:
-            initial_size = 0
+            try:
+                initial_size = os.stat(temp_file_name).st_size
+            except OSError:
+                pass
         # This should never happen if our functions work properly
         if initial_size > file_size:
             raise RuntimeError('Local file (%s) is larger than remote '
@@ -1965,17 +2412,53 @@ def _fetch_file(url, file_name, print_destination=True, resume=True,
 
         scheme = urllib.parse.urlparse(url).scheme
         fun = _get_http if scheme in ('http', 'https') else _get_ftp
-        fun(url, temp_file_name, initial_size, file_size, verbose_bool)
+        # hash the chunks as they stream through to avoid re-reading the
+        # file afterward; on a resume the already-downloaded part is fed
+        # in first so the digest stays valid
+        hash_obj = None
+        if hash_ is not None:
+            hash_obj = hashlib.new(hash_type)
+            if initial_size > 0:
+                with open(temp_file_name, 'rb', buffering=0) as local_file:
+                    while True:
+                        chunk = local_file.read(_DOWNLOAD_BLOCK_SIZE)
+                        if not chunk:
+                            break
+                        hash_obj.update(chunk)
+        hash_obj = fun(url, temp_file_name, initial_size, file_size,
+                       verbose_bool, hash_obj, accept_ranges)
 
         # check md5sum
         if hash_ is not None:
             logger.info('Verifying download hash.')
-            md5 = md5sum(temp_file_name)
-            if hash_ != md5:
+            got_hash = hash_obj.hexdigest()
+            if hash_ != got_hash:
                 raise RuntimeError('Hash mismatch for downloaded file %s, '
                                    'expected %s but got %s'
-                                   % (temp_file_name, hash_, md5))
-        shutil.move(temp_file_name, file_name)
+                                   % (temp_file_name, hash_, got_hash))
+        if hasattr(os, 'posix_fadvise'):
+            # the writers fsynced before closing, so the pages are clean;
+            # the archive is typically only read back after unpacking, so
+            # let the kernel drop them (the rename below keeps the inode)
+            with open(temp_file_name, 'rb') as fid:
+                try:
+                    os.posix_fadvise(fid.fileno(), 0, 0,
+                                     os.POSIX_FADV_DONTNEED)
+                except OSError:
+                    pass
+        try:
+            # the temp file lives next to the destination, so this is
+            # normally just an atomic rename
+            os.rename(temp_file_name, file_name)
+        except OSError:
+            # cross-device fallback (e.g. destination is a link to
+            # another mount); copy with a large buffer, then unlink
+            with open(temp_file_name, 'rb') as src, \
+                    open(file_name, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 16 * _DOWNLOAD_BLOCK_SIZE)
+            os.remove(temp_file_name)
+        if hash_ is not None:
+            _write_hash_sidecar(file_name, hash_, hash_type)
         if print_destination is True:
             logger.info('File saved as %s.\n' % file_name)
     except Exception:
@@ -1984,6 +2467,79 @@ def _fetch_file(url, file_name, print_destination=True, resume=True,
         raise
 
 
+@verbose
+def _fetch_files(urls, file_names, resume=True, hashes=None, timeout=10.,
+                 n_jobs=4, verbose=None):
+    """Fetch several files, downloading them concurrently.
+
+    Parameters
+    ----------
+    urls : list of str
+        The urls of the files to be downloaded.
+    file_names : list of str
+        The destination file names, one per url.
+    resume : bool
+        If True, try to resume partially downloaded files.
+    hashes : list of str | None
+        The expected hashes, one per url. If None, no checking is performed.
+    timeout : float
+        The URL open timeout.
+    n_jobs : int
+        Maximum number of concurrent downloads.
+    verbose : bool, str, int, or None
+        If not None, override default verbose level (see :func:`mne.verbose`
+        and :ref:`Logging documentation <tut_logging>` for more).
+    """
+    from .externals.six.moves import queue
+    if len(urls) != len(file_names):
+        raise ValueError('urls and file_names must have the same length '
+                         '(%d != %d)' % (len(urls), len(file_names)))
+    hashes = [None] * len(urls) if hashes is None else hashes
+    q = queue.Queue()
+    for idx in range(len(urls)):
+        q.put(idx)
+    errors = []
+
+    def _worker():
+        while True:
+            try:
+                idx = q.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                _fetch_file(urls[idx], file_names[idx], resume=resume,
+                            hash_=hashes[idx], timeout=timeout,
+                            print_destination=False)
+            except Exception as exc:
+                errors.append((urls[idx], exc))
+
+    n_jobs = min(max(int(n_jobs), 1), len(urls))
+    if n_jobs <= 1:
+        _worker()
+    else:
+        logger.info('Downloading %d files (%d concurrent downloads)'
+                    % (len(urls), n_jobs))
+        threads = [threading.Thread(target=_worker) for _ in range(n_jobs)]
+        # concurrent progress bars would garble the console, so quiet the
+        # per-file output while the workers run (errors still get through)
+        with use_log_level('warning'):
+            for t in threads:
+                t.daemon = True
+                t.start()
+            for t in threads:
+                t.join()
+    if len(errors) > 0:
+        if len(errors) > 1:
+            logger.error('%d files failed to download, re-raising the first '
+                         'error' % len(errors))
+        raise errors[0][1]
+
+
+_SIZE_UNITS = tuple((unit, '{0:.%df} {1}' % (decimals,)) for unit, decimals
+                    in zip(('bytes', 'kB', 'MB', 'GB', 'TB', 'PB'),
+                           (0, 0, 1, 2, 2, 2)))
+
+
 def sizeof_fmt(num):
     """Turn number of bytes into human-readable str.
 
@@ -1997,14 +2553,12 @@ def sizeof_fmt(num):
     size : str
         The size in human-readable format.
     """
-    units = ['bytes', 'kB', 'MB', 'GB', 'TB', 'PB']
-    decimals = [0, 0, 1, 2, 2, 2]
     if num > 1:
-        exponent = min(int(log(num, 1024)), len(units) - 1)
+        # (bit_length - 1) // 10 is floor(log(num, 1024)) without the
+        # transcendentals; this helper runs on every progress update
+        exponent = min((int(num).bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
         quotient = float(num) / 1024 ** exponent
-        unit = units[exponent]
-        num_decimals = decimals[exponent]
-        format_string = '{0:.%sf} {1}' % (num_decimals)
+        unit, format_string = _SIZE_UNITS[exponent]
         return format_string.format(quotient, unit)
     if num == 0:
         return '0 bytes'
@@ -2051,15 +2605,26 @@ class SizeMixin(object):
             raise RuntimeError('Hashing unknown object type: %s' % type(self))
 
 
+_URL_PATH_CACHE = dict()
+
+
 def _url_to_local_path(url, path):
     """Mirror a url path in a local destination (keeping folder structure)."""
-    destination = urllib.parse.urlparse(url).path
-    # First char should be '/', and it needs to be discarded
-    if len(destination) < 2 or destination[0] != '/':
-        raise ValueError('Invalid URL')
-    destination = os.path.join(path,
-                               urllib.request.url2pathname(destination)[1:])
-    return destination
+    from .externals.six.moves import urllib
+    # dataset code resolves many urls under one prefix, and urlparse and
+    # url2pathname are regex-heavy pure Python, so cache the translation
+    try:
+        destination = _URL_PATH_CACHE[url]
+    except KeyError:
+        destination = urllib.parse.urlparse(url).path
+        # First char should be '/', and it needs to be discarded
+        if len(destination) < 2 or destination[0] != '/':
+            raise ValueError('Invalid URL')
+        destination = urllib.request.url2pathname(destination)[1:]
+        if len(_URL_PATH_CACHE) > 1024:
+            _URL_PATH_CACHE.clear()
+        _URL_PATH_CACHE[url] = destination
+    return os.path.join(path, destination)
 
 
 def _get_stim_channel(stim_channel, info, raise_error=True):
@@ -2174,9 +2739,10 @@ def _check_pandas_installed():
 
 def _check_pandas_index_arguments(index, defaults):
     """Check pandas index arguments."""
-    if not any(isinstance(index, k) for k in (list, tuple)):
+    if not isinstance(index, (list, tuple)):
         index = [index]
-    invalid_choices = [e for e in index if e not in defaults]
+    defaults_set = frozenset(defaults)
+    invalid_choices = [e for e in index if e not in defaults_set]
     if invalid_choices:
         options = [', '.join(e) for e in [invalid_choices, defaults]]
         raise ValueError('[%s] is not an valid option. Valid index'
@@ -2340,7 +2906,28 @@ def md5sum(fname, block_size=1048576):  # 2 ** 20
         The hexadecimal digest of the hash.
     """
     md5 = hashlib.md5()
-    with open(fname, 'rb') as fid:
+    # unbuffered: the reads are already large, so the default 8 kB stdio
+    # buffer would only add an extra copy per block
+    with open(fname, 'rb', buffering=0) as fid:
+        if os.name == 'posix' and \
+                os.fstat(fid.fileno()).st_size > 16777216:
+            # large file: let the kernel prefetch the mapping and hash it
+            # in one update() call, skipping the per-block Python loop
+            import mmap
+            try:
+                mm = mmap.mmap(fid.fileno(), 0, prot=mmap.PROT_READ)
+            except (OSError, ValueError, OverflowError):
+                # e.g. map limits, or a file too large for a 32-bit
+                # address space; fall back to the chunked loop
+                pass
+            else:
+                try:
+                    if hasattr(mm, 'madvise'):  # Python >= 3.8
+                        mm.madvise(mmap.MADV_SEQUENTIAL)
+                    md5.update(mm)
+                finally:
+                    mm.close()
+                return md5.hexdigest()
         while True:
             data = fid.read(block_size)
             if not data: